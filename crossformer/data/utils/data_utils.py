@@ -1,37 +1,64 @@
 from enum import Enum
-from fnmatch import fnmatch
+import fnmatch
+import functools
 import hashlib
-import json
 import logging
 import os
+import re
 from typing import Any, Callable, Dict, List, Optional, Tuple
 
 import dlimp as dl
 import numpy as np
+import orjson
 import tensorflow as tf
 import tqdm
 
 
+@functools.lru_cache(maxsize=1024)
+def _compile_glob(template: str):
+    """Compiles an fnmatch-style glob pattern once; `fnmatch.fnmatch` would
+    retranslate the pattern on every call."""
+    return re.compile(fnmatch.translate(template)).match
+
+
 def fnmatch_filter(template, xs):
-    return [x for x in xs if fnmatch(x, template)]
+    match = _compile_glob(template)
+    return [x for x in xs if match(x)]
 
 
 def tree_map(fn: Callable, tree: dict) -> dict:
     """Maps a function over a nested dictionary."""
-    return {
-        k: tree_map(fn, v) if isinstance(v, dict) else fn(v) for k, v in tree.items()
-    }
+    # iterative with an explicit stack to avoid a Python call frame per level;
+    # note that only dicts count as structure (leaves may be lists or scalars),
+    # which rules out dm-tree's map_structure here
+    result = {}
+    stack = [(tree, result)]
+    while stack:
+        src, dst = stack.pop()
+        for k, v in src.items():
+            if isinstance(v, dict):
+                dst[k] = child = {}
+                stack.append((v, child))
+            else:
+                dst[k] = fn(v)
+    return result
 
 
 def tree_merge(*trees: dict) -> dict:
     """Merges a list of nested dictionaries, with later dictionaries overriding earlier ones."""
     merged = {}
     for tree in trees:
-        for k, v in tree.items():
-            if isinstance(v, dict):
-                merged[k] = tree_merge(merged.get(k, {}), v)
-            else:
-                merged[k] = v
+        stack = [(merged, tree)]
+        while stack:
+            dst, src = stack.pop()
+            for k, v in src.items():
+                if isinstance(v, dict):
+                    node = dst.get(k)
+                    if not isinstance(node, dict):
+                        dst[k] = node = {}
+                    stack.append((node, v))
+                else:
+                    dst[k] = v
     return merged
 
 
@@ -42,8 +69,30 @@ class NormalizationType(str, Enum):
     BOUNDS = "bounds"  # normalize to [-1, 1]
 
 
+# mirrors the dtype set accepted by tf.debugging.is_numeric_tensor, checked
+# directly to skip that function's Python-level type inspection per call
+_NUMERIC_DTYPES = frozenset(
+    {
+        tf.float16,
+        tf.bfloat16,
+        tf.float32,
+        tf.float64,
+        tf.int8,
+        tf.int16,
+        tf.int32,
+        tf.int64,
+        tf.uint8,
+        tf.uint16,
+        tf.uint32,
+        tf.uint64,
+        tf.complex64,
+        tf.complex128,
+    }
+)
+
+
 def to_padding(tensor: tf.Tensor) -> tf.Tensor:
-    if tf.debugging.is_numeric_tensor(tensor):
+    if tensor.dtype in _NUMERIC_DTYPES:
         return tf.zeros_like(tensor)
     elif tensor.dtype == tf.string:
         return tf.fill(tf.shape(tensor), "")
@@ -53,14 +102,17 @@ def to_padding(tensor: tf.Tensor) -> tf.Tensor:
 
 def sample_match_keys_uniform(d: dict, key_template: str):
     """Samples uniformly from all keys fnmatching the template."""
-    match_keys = [key for key in d.keys() if fnmatch(key, key_template)]
+    match = _compile_glob(key_template)
+    match_keys = [key for key in d.keys() if match(key)]
     if not match_keys:
         raise ValueError(f"No matching key found for {key_template}. Keys: {d.keys()}")
     logging.info(f"Sampling uniformly across keys: {match_keys}")
     if len(match_keys) > 1:
-        stacked = tf.stack([d[key] for key in match_keys])
-        idx = tf.random.uniform((), 0, len(stacked) - 1, dtype=tf.int32)
-        return stacked[idx]
+        # sample the index first and only materialize the chosen entry instead
+        # of stacking (copying) every candidate; maxval is exclusive, so this
+        # also lets the last key actually be sampled
+        idx = tf.random.uniform((), 0, len(match_keys), dtype=tf.int32)
+        return tf.switch_case(idx, [lambda key=key: d[key] for key in match_keys])
     else:
         return d[match_keys[0]]
 
@@ -82,6 +134,83 @@ def pprint_data_mixture(
     )
 
 
+# resolution of the streaming quantile sketches used for the p01/p99 bounds; the
+# fine level resolves (p999 - p001) / _QUANTILE_BINS per dimension, so outliers
+# beyond the robust bounds do not degrade the accuracy of the reported bounds
+_QUANTILE_BINS = 4096
+
+# number of transitions handed to each sketch update during the quantile pass
+_STATS_BATCH_SIZE = 4096
+
+# process-level cache of dataset statistics, keyed by `unique_hash`; avoids
+# re-hitting the (possibly remote) filesystem when the same dataset is loaded
+# multiple times in one process (e.g. during config expansion)
+_STATS_CACHE: Dict[str, dict] = {}
+
+
+def _update_histogram(
+    hist: np.ndarray, values: np.ndarray, low: np.ndarray, width: np.ndarray
+) -> None:
+    """Accumulates a batch of values of shape (n, dim) into per-dimension
+    fixed-width histograms of shape (dim, num_bins)."""
+    num_bins = hist.shape[1]
+    # clip before casting so far-out-of-range values cannot overflow the cast
+    bins = (values - low) / width * num_bins
+    np.clip(bins, 0, num_bins - 1, out=bins)
+    bins = bins.astype(np.int64)
+    flat = bins + np.arange(hist.shape[0], dtype=np.int64) * num_bins
+    hist += np.bincount(flat.ravel(), minlength=hist.size).reshape(hist.shape)
+
+
+def _histogram_quantile(
+    hist: np.ndarray, low: np.ndarray, width: np.ndarray, q: float
+) -> np.ndarray:
+    """Reads an approximate per-dimension quantile off fixed-width histograms,
+    interpolating linearly within the selected bin."""
+    num_bins = hist.shape[1]
+    cdf = np.cumsum(hist, axis=1)
+    target = q * cdf[:, -1]
+    idx = np.minimum((cdf < target[:, None]).sum(axis=1), num_bins - 1)
+    prev = np.where(
+        idx > 0,
+        np.take_along_axis(cdf, np.maximum(idx - 1, 0)[:, None], axis=1)[:, 0],
+        0,
+    )
+    count = np.take_along_axis(hist, idx[:, None], axis=1)[:, 0]
+    frac = np.where(count > 0, (target - prev) / np.maximum(count, 1), 0.0)
+    return low + (idx + frac) * (width / num_bins)
+
+
+@functools.lru_cache(maxsize=None)
+def _probe_writable(save_dir: str) -> bool:
+    """Checks whether `save_dir` accepts writes by round-tripping a sentinel
+    file. Needed before installing a dataset snapshot: tf.data is lazy, so a
+    snapshot pointed at a read-only directory (e.g. a public GCS bucket) would
+    otherwise only fail in the middle of iterating the dataset."""
+    probe = tf.io.gfile.join(save_dir, ".crossformer_write_probe")
+    try:
+        with tf.io.gfile.GFile(probe, "w") as f:
+            f.write("")
+        tf.io.gfile.remove(probe)
+        return True
+    except tf.errors.OpError:
+        return False
+
+
+@functools.lru_cache(maxsize=None)
+def _existing_statistics_files(save_dir: str) -> frozenset:
+    """Lists the statistics cache files in `save_dir` once per process: a single
+    glob round-trip replaces one `exists` call per dataset, which matters on
+    remote filesystems."""
+    try:
+        paths = tf.io.gfile.glob(
+            tf.io.gfile.join(save_dir, "dataset_statistics_*.json")
+        )
+    except tf.errors.NotFoundError:
+        return frozenset()
+    return frozenset(map(os.path.basename, paths))
+
+
 def get_dataset_statistics(
     dataset: dl.DLataset,
     proprio_keys: list,
@@ -93,10 +222,15 @@ def get_dataset_statistics(
     called before with the same `hash_dependencies`. Currently, the statistics include the min/max/mean/std of
     the actions and proprio as well as the number of transitions and trajectories in the dataset.
     """
-    unique_hash = hashlib.sha256(
-        "".join(hash_dependencies).encode("utf-8"),
-        usedforsecurity=False,
-    ).hexdigest()
+    # feed the dependencies into the hash incrementally instead of materializing
+    # one large joined string; blake2b is also considerably faster than sha256
+    hasher = hashlib.blake2b(digest_size=32, usedforsecurity=False)
+    for dependency in hash_dependencies:
+        hasher.update(dependency.encode("utf-8"))
+    unique_hash = hasher.hexdigest()
+
+    if unique_hash in _STATS_CACHE and not force_recompute:
+        return _STATS_CACHE[unique_hash]
 
     # fallback local path for when data_dir is not writable or not provided
     local_path = os.path.expanduser(
@@ -114,25 +248,45 @@ def get_dataset_statistics(
         path = local_path
 
     # check if cache file exists and load
-    if tf.io.gfile.exists(path) and not force_recompute:
+    if save_dir is not None:
+        cached = os.path.basename(path) in _existing_statistics_files(save_dir)
+    else:
+        cached = os.path.exists(path)
+    if cached and not force_recompute:
         logging.info(f"Loading existing dataset statistics from {path}.")
-        with tf.io.gfile.GFile(path, "r") as f:
-            metadata = json.load(f)
+        with tf.io.gfile.GFile(path, "rb") as f:
+            metadata = orjson.loads(f.read())
+        _STATS_CACHE[unique_hash] = metadata
         return metadata
 
     if os.path.exists(local_path) and not force_recompute:
         logging.info(f"Loading existing dataset statistics from {local_path}.")
-        with open(local_path, "r") as f:
-            metadata = json.load(f)
+        with open(local_path, "rb") as f:
+            metadata = orjson.loads(f.read())
+        _STATS_CACHE[unique_hash] = metadata
         return metadata
 
     dataset = dataset.traj_map(
         lambda traj: {
             "action": traj["action"],
             **({key: traj["observation"][key] for key in proprio_keys}),
-        }
+        },
+        tf.data.AUTOTUNE,
     )
 
+    # persist the projected (action/proprio only) trajectories next to the
+    # statistics cache: the first pass writes the snapshot, so the quantile
+    # passes below re-read the compact projection instead of decoding the full
+    # observations from the TFRecord shards again. Skipped on force_recompute
+    # (a stale snapshot would defeat the recompute) and when save_dir is not
+    # writable -- `get_dataset_statistics` supports read-only save_dirs via the
+    # local cache fallback below, and since the snapshot only materializes
+    # during iteration, a permission error would otherwise surface mid-pass
+    if save_dir is not None and not force_recompute and _probe_writable(save_dir):
+        dataset = dataset.snapshot(
+            tf.io.gfile.join(save_dir, f"dataset_statistics_snapshot_{unique_hash}")
+        )
+
     cardinality = dataset.cardinality().numpy()
     if cardinality == tf.data.INFINITE_CARDINALITY:
         raise ValueError("Cannot compute dataset statistics for infinite datasets.")
@@ -141,58 +295,167 @@ def get_dataset_statistics(
         "Computing dataset statistics. This may take awhile, but should only need to happen "
         "once for each dataset."
     )
-    actions = []
-    proprios = {}
-    num_transitions = 0
-    num_trajectories = 0
-    for traj in tqdm.tqdm(
-        dataset.iterator(),
-        total=cardinality if cardinality != tf.data.UNKNOWN_CARDINALITY else None,
-    ):
-        actions.append(traj["action"])
-        for key in proprio_keys:
-            if key not in proprios:
-                proprios[key] = [traj[key]]
-            proprios[key].append(traj[key])
-        num_transitions += traj["action"].shape[0]
-        num_trajectories += 1
-    actions = np.concatenate(actions)
-    metadata = {
-        "action": {
-            "mean": actions.mean(0).tolist(),
-            "std": actions.std(0).tolist(),
-            "max": actions.max(0).tolist(),
-            "min": actions.min(0).tolist(),
-            "p99": np.quantile(actions, 0.99, 0).tolist(),
-            "p01": np.quantile(actions, 0.01, 0).tolist(),
+    keys = ["action"] + list(proprio_keys)
+    elem_spec = dataset.element_spec
+
+    # accumulate count/sum/sum-of-squares/min/max inside the tf.data graph; this keeps
+    # peak memory at O(dim) instead of O(num_transitions * dim) and lets tf decode
+    # trajectories in parallel instead of serializing behind the Python iterator
+    initial_state = {
+        "num_transitions": tf.constant(0, tf.int64),
+        "num_trajectories": tf.constant(0, tf.int64),
+        **{
+            key: {
+                "sum": tf.zeros(elem_spec[key].shape[-1], tf.float64),
+                "sum_sq": tf.zeros(elem_spec[key].shape[-1], tf.float64),
+                "min": tf.fill(
+                    elem_spec[key].shape[-1:], tf.constant(np.inf, tf.float64)
+                ),
+                "max": tf.fill(
+                    elem_spec[key].shape[-1:], tf.constant(-np.inf, tf.float64)
+                ),
+            }
+            for key in keys
         },
+    }
+
+    def reduce_fn(state, traj):
+        new_state = {
+            "num_transitions": state["num_transitions"]
+            + tf.cast(tf.shape(traj["action"])[0], tf.int64),
+            "num_trajectories": state["num_trajectories"] + 1,
+        }
+        for key in keys:
+            values = tf.cast(traj[key], tf.float64)
+            new_state[key] = {
+                "sum": state[key]["sum"] + tf.reduce_sum(values, axis=0),
+                "sum_sq": state[key]["sum_sq"]
+                + tf.reduce_sum(tf.square(values), axis=0),
+                "min": tf.minimum(state[key]["min"], tf.reduce_min(values, axis=0)),
+                "max": tf.maximum(state[key]["max"], tf.reduce_max(values, axis=0)),
+            }
+        return new_state
+
+    state = tf.nest.map_structure(
+        lambda x: x.numpy(), dataset.reduce(initial_state, reduce_fn)
+    )
+    num_transitions = int(state["num_transitions"])
+    num_trajectories = int(state["num_trajectories"])
+
+    # the p01/p99 bounds come from two-level streaming histogram sketches
+    # instead of materializing every value for np.quantile. a min/max-bounded
+    # histogram alone is not enough: its resolution would be dictated by exactly
+    # the outliers the bounds exist to clip. the coarse level therefore bins in
+    # arcsinh space (resolution degrades only logarithmically with outlier
+    # magnitude) and supplies robust bounds for the fine, linear-space level,
+    # whose resolution is then set by the bulk of the data
+
+    # the sketches don't care about trajectory boundaries, so rebatch the
+    # trajectories into fixed-size transition batches and prefetch: tf decodes
+    # in parallel C++ threads while Python updates the sketches
+    transition_dataset = (
+        dataset.unbatch().batch(_STATS_BATCH_SIZE).prefetch(tf.data.AUTOTUNE)
+    )
+
+    def sketch_pass(lows, widths, transform):
+        histograms = {
+            key: np.zeros((state[key]["sum"].shape[0], _QUANTILE_BINS), np.int64)
+            for key in keys
+        }
+        for batch in tqdm.tqdm(
+            transition_dataset.as_numpy_iterator(),
+            total=-(-num_transitions // _STATS_BATCH_SIZE),
+        ):
+            for key in keys:
+                _update_histogram(
+                    histograms[key], transform(batch[key]), lows[key], widths[key]
+                )
+        return histograms
+
+    coarse_lows = {key: np.arcsinh(state[key]["min"]) for key in keys}
+    coarse_widths = {
+        key: np.where(
+            state[key]["max"] > state[key]["min"],
+            np.arcsinh(state[key]["max"]) - coarse_lows[key],
+            1.0,
+        )
+        for key in keys
+    }
+    coarse = sketch_pass(coarse_lows, coarse_widths, np.arcsinh)
+
+    # robust bounds at p0.001/p0.999, widened by a two-bin safety margin: the
+    # p01/p99 targets lie strictly inside, so outliers clipped into the edge
+    # bins of the fine level cannot move them
+    lows = {}
+    widths = {}
+    for key in keys:
+        margin = 2 * coarse_widths[key] / _QUANTILE_BINS
+        low = np.maximum(
+            np.sinh(
+                _histogram_quantile(
+                    coarse[key], coarse_lows[key], coarse_widths[key], 0.001
+                )
+                - margin
+            ),
+            state[key]["min"],
+        )
+        high = np.minimum(
+            np.sinh(
+                _histogram_quantile(
+                    coarse[key], coarse_lows[key], coarse_widths[key], 0.999
+                )
+                + margin
+            ),
+            state[key]["max"],
+        )
+        lows[key] = low
+        widths[key] = np.where(high > low, high - low, 1.0)
+
+    histograms = sketch_pass(lows, widths, lambda values: values)
+
+    def summarize(key):
+        mean = state[key]["sum"] / num_transitions
+        std = np.sqrt(
+            np.maximum(state[key]["sum_sq"] / num_transitions - mean**2, 0.0)
+        )
+        # float32 carries plenty of precision for normalization statistics and
+        # roughly halves the serialized payload
+        return {
+            "mean": mean.astype(np.float32),
+            "std": std.astype(np.float32),
+            "max": state[key]["max"].astype(np.float32),
+            "min": state[key]["min"].astype(np.float32),
+            "p99": _histogram_quantile(
+                histograms[key], lows[key], widths[key], 0.99
+            ).astype(np.float32),
+            "p01": _histogram_quantile(
+                histograms[key], lows[key], widths[key], 0.01
+            ).astype(np.float32),
+        }
+
+    metadata = {
+        "action": summarize("action"),
         "num_transitions": num_transitions,
         "num_trajectories": num_trajectories,
+        **{key: summarize(key) for key in proprio_keys},
     }
-    if proprios:
-        for key in proprios:
-            proprios[key] = np.concatenate(proprios[key])
-            metadata[key] = {
-                "mean": proprios[key].mean(0).tolist(),
-                "std": proprios[key].std(0).tolist(),
-                "max": proprios[key].max(0).tolist(),
-                "min": proprios[key].min(0).tolist(),
-                "p99": np.quantile(proprios[key], 0.99, 0).tolist(),
-                "p01": np.quantile(proprios[key], 0.01, 0).tolist(),
-            }
 
+    payload = orjson.dumps(metadata, option=orjson.OPT_SERIALIZE_NUMPY)
     try:
-        with tf.io.gfile.GFile(path, "w") as f:
-            json.dump(metadata, f)
+        with tf.io.gfile.GFile(path, "wb") as f:
+            f.write(payload)
     except tf.errors.PermissionDeniedError:
         logging.warning(
             f"Could not write dataset statistics to {path}. "
             f"Writing to {local_path} instead."
         )
         os.makedirs(os.path.dirname(local_path), exist_ok=True)
-        with open(local_path, "w") as f:
-            json.dump(metadata, f)
+        with open(local_path, "wb") as f:
+            f.write(payload)
 
+    # round-trip so the returned structure matches what a cache load produces
+    metadata = orjson.loads(payload)
+    _STATS_CACHE[unique_hash] = metadata
     return metadata
 
 
@@ -204,69 +467,59 @@ def normalize_action_and_proprio(
     skip_norm_keys: list,
 ):
     """Normalizes the action and proprio fields of a trajectory using the given metadata."""
-    # maps keys of `metadata` to corresponding keys in `traj`
+    # maps keys of `metadata` to the corresponding nested paths in `traj`
     keys_to_normalize = {
-        "action": "action",
+        "action": ("action",),
     }
     for key in proprio_keys:
-        keys_to_normalize[key] = f"observation/{key}"
+        keys_to_normalize[key] = ("observation", key)
     keys_to_normalize = {
         k: v for k, v in keys_to_normalize.items() if k not in skip_norm_keys
     }
 
-    if normalization_type == NormalizationType.NORMAL:
-        # normalize to mean 0, std 1
-        for key, traj_key in keys_to_normalize.items():
-            mask = metadata[key].get(
-                "mask", tf.ones_like(metadata[key]["mean"], dtype=tf.bool)
-            )
-            traj = dl.transforms.selective_tree_map(
-                traj,
-                match=lambda k, _: k == traj_key,
-                map_fn=lambda x: tf.where(
-                    mask, (x - metadata[key]["mean"]) / (metadata[key]["std"] + 1e-8), x
-                ),
+    if normalization_type not in (NormalizationType.NORMAL, NormalizationType.BOUNDS):
+        raise ValueError(f"Unknown normalization type {normalization_type}")
+
+    for key, path in keys_to_normalize.items():
+        stats = metadata[key]
+        # bake the statistics into constants at trace time so each key is
+        # normalized by a single fused expression, instead of walking the whole
+        # trajectory tree once per key with selective_tree_map
+        if normalization_type == NormalizationType.NORMAL:
+            # normalize to mean 0, std 1
+            mask = tf.constant(
+                np.asarray(stats.get("mask", np.ones_like(stats["mean"], dtype=bool))),
+                dtype=tf.bool,
             )
-        return traj
-
-    if normalization_type == NormalizationType.BOUNDS:
-        # normalize to [-1, 1]
-        for key, traj_key in keys_to_normalize.items():
-            mask = metadata[key].get(
-                "mask", tf.ones_like(metadata[key]["p01"], dtype=tf.bool)
+            mean = tf.constant(np.asarray(stats["mean"]), dtype=tf.float32)
+            std = tf.constant(np.asarray(stats["std"]), dtype=tf.float32)
+            map_fn = lambda x: tf.where(mask, (x - mean) / (std + 1e-8), x)
+        else:
+            # normalize to [-1, 1]
+            mask = tf.constant(
+                np.asarray(stats.get("mask", np.ones_like(stats["p01"], dtype=bool))),
+                dtype=tf.bool,
             )
-            traj = dl.transforms.selective_tree_map(
-                traj,
-                match=lambda k, _: k == traj_key,
-                map_fn=lambda x: tf.where(
-                    mask,
-                    tf.clip_by_value(
-                        2
-                        * (x - metadata[key]["p01"])
-                        / (metadata[key]["p99"] - metadata[key]["p01"] + 1e-8)
-                        - 1,
-                        -1,
-                        1,
-                    ),
-                    x,
-                ),
+            p01 = tf.constant(np.asarray(stats["p01"]), dtype=tf.float32)
+            p99 = tf.constant(np.asarray(stats["p99"]), dtype=tf.float32)
+            map_fn = lambda x: tf.where(
+                mask,
+                tf.clip_by_value(2 * (x - p01) / (p99 - p01 + 1e-8) - 1, -1, 1),
+                x,
             )
-        return traj
 
-    raise ValueError(f"Unknown normalization type {normalization_type}")
+        parent = traj
+        for part in path[:-1]:
+            parent = parent[part]
+        parent[path[-1]] = map_fn(parent[path[-1]])
 
+    return traj
 
-def binarize_gripper_actions(actions: tf.Tensor, open_boundary: float = 0.95, close_boundary: float = 0.05) -> tf.Tensor:
-    """Converts gripper actions from continous to binary values (0 and 1).
 
-    We exploit that fact that most of the time, the gripper is fully open (near 1.0) or fully closed (near
-    0.0). As it transitions between the two, it sometimes passes through a few intermediate values. We relabel
-    those intermediate values based on the state that is reached _after_ those intermediate values.
-
-    In the edge case that the trajectory ends with an intermediate value, we give up on binarizing and relabel
-    that chunk of intermediate values as the last action in the trajectory.
-
-    The scan implements the following code:
+def _binarize_gripper_actions_np(
+    actions: np.ndarray, open_boundary: float, close_boundary: float
+) -> np.ndarray:
+    """Vectorized reverse fill implementing the following code:
 
     new_actions = np.empty_like(actions)
     carry = actions[-1]
@@ -277,22 +530,42 @@ def binarize_gripper_actions(actions: tf.Tensor, open_boundary: float = 0.95, cl
             carry = float(open_mask[i])
         new_actions[i] = carry
     """
-    open_mask = actions > open_boundary # 0.95
-    closed_mask = actions < close_boundary # 0.05
-    in_between_mask = tf.logical_not(tf.logical_or(open_mask, closed_mask))
+    open_mask = actions > open_boundary
+    closed_mask = actions < close_boundary
+    in_between_mask = ~(open_mask | closed_mask)
 
-    is_open_float = tf.cast(open_mask, actions.dtype)
+    is_open_float = open_mask.astype(actions.dtype)
 
-    def scan_fn(carry, i):
-        return tf.cond(
-            in_between_mask[i],
-            lambda: tf.cast(carry, actions.dtype),
-            lambda: is_open_float[i],
-        )
+    n = actions.shape[0]
+    # index of the next non-intermediate timestep at or after each position (n if none)
+    next_boundary = np.minimum.accumulate(
+        np.where(in_between_mask, n, np.arange(n))[::-1]
+    )[::-1]
+    return np.where(
+        next_boundary < n,
+        is_open_float[np.minimum(next_boundary, n - 1)],
+        actions[-1],
+    ).astype(actions.dtype)
+
+
+def binarize_gripper_actions(actions: tf.Tensor, open_boundary: float = 0.95, close_boundary: float = 0.05) -> tf.Tensor:
+    """Converts gripper actions from continous to binary values (0 and 1).
 
-    new_actions = tf.scan(
-        scan_fn, tf.range(tf.shape(actions)[0]), actions[-1], reverse=True
+    We exploit that fact that most of the time, the gripper is fully open (near 1.0) or fully closed (near
+    0.0). As it transitions between the two, it sometimes passes through a few intermediate values. We relabel
+    those intermediate values based on the state that is reached _after_ those intermediate values.
+
+    In the edge case that the trajectory ends with an intermediate value, we give up on binarizing and relabel
+    that chunk of intermediate values as the last action in the trajectory.
+
+    The reverse fill runs as a single vectorized NumPy call instead of a tf.scan with a tf.cond per timestep.
+    """
+    new_actions = tf.numpy_function(
+        lambda a: _binarize_gripper_actions_np(a, open_boundary, close_boundary),
+        [actions],
+        actions.dtype,
     )
+    new_actions.set_shape(actions.shape)
     return new_actions
 
 
@@ -308,19 +581,14 @@ def rel_open_or_closed(actions: tf.Tensor):
     old_state_mask = tf.where(opening_mask, -1, tf.where(closing_mask, -1, 0))
     # old_state_mask is 1 if closing, -1 if opening, 0 if no change
 
-    def scan_fn(carry, i):
-        return tf.cond(
-            old_state_mask[i] == 0,
-            lambda: tf.cast(carry, tf.float32),
-            lambda: (tf.cast(old_state_mask[i], tf.float32) + 1) / 2,
-        )
-
-    return tf.scan(
-        scan_fn,
-        tf.range(tf.shape(actions)[0]),
-        tf.zeros_like(actions[-1]),
-        reverse=True,
-    )[0]
+    # the reverse scan reduces to the first change in the trajectory (or the
+    # zero initializer if there is none), so read it off directly
+    first_idx = tf.argmax(old_state_mask != 0, axis=0)
+    return tf.where(
+        tf.reduce_any(old_state_mask != 0),
+        (tf.cast(old_state_mask[first_idx], tf.float32) + 1) / 2,
+        0.0,
+    )
 
 
 def rel2abs_gripper_actions(actions: tf.Tensor):
@@ -335,18 +603,20 @@ def rel2abs_gripper_actions(actions: tf.Tensor):
     # -1 for closing, 1 for opening, 0 for no change
     thresholded_actions = tf.where(opening_mask, 1, tf.where(closing_mask, -1, 0))
 
-    def scan_fn(carry, i):
-        return tf.cond(
-            thresholded_actions[i] == 0,
-            lambda: carry,
-            lambda: thresholded_actions[i],
-        )
-
     # if no relative grasp, assumes open for whole trajectory
     start = -1 * thresholded_actions[tf.argmax(thresholded_actions != 0, axis=0)]
-    start = tf.cond(start == 0, lambda: 1, lambda: start)
+    start = tf.where(start == 0, 1, start)
+
+    # carry the most recent nonzero entry forward (or `start` if there is none
+    # yet): for each timestep, look up the last nonzero index at or before it
+    # with a searchsorted instead of a tf.scan with a tf.cond per timestep
+    nonzero_idx = tf.cast(tf.where(thresholded_actions != 0)[:, 0], tf.int32)
+    segment = tf.searchsorted(nonzero_idx, tf.range(tf.shape(actions)[0]), side="right")
     # -1 for closed, 1 for open
-    new_actions = tf.scan(scan_fn, tf.range(tf.shape(actions)[0]), start)
+    new_actions = tf.gather(
+        tf.concat([[start], tf.gather(thresholded_actions, nonzero_idx)], axis=0),
+        segment,
+    )
 
     new_actions = tf.cast(new_actions, tf.float32) / 2 + 0.5
     return new_actions
@@ -365,8 +635,9 @@ def relabel_actions(traj: Dict[str, Any]) -> Dict[str, Any]:
         traj["observation"]["state"][1:, :6] - traj["observation"]["state"][:-1, :6]
     )
 
-    # discard the last timestep of the trajectory
-    traj_truncated = tf.nest.map_structure(lambda x: x[:-1], traj)
+    # discard the last timestep of the trajectory; `tree_map` slices the leaves
+    # in a single walk instead of tf.nest's flatten + repack round-trip
+    traj_truncated = tree_map(lambda x: x[:-1], traj)
 
     # recombine to get full actions
     traj_truncated["action"] = tf.concat(
@@ -391,17 +662,24 @@ def allocate_threads(n: Optional[int], weights: np.ndarray):
     weights = np.array(weights) / np.sum(weights)
 
     allocation = np.zeros_like(weights, dtype=int)
-    while True:
-        # give the remaining elements that would get less than 1 a 1
-        mask = (weights * n < 1) & (weights > 0)
-        if not mask.any():
-            break
-        n -= mask.sum()
-        allocation += mask.astype(int)
-        # recompute the distribution over the remaining elements
-        weights[mask] = 0
+    # a dataset gets exactly 1 thread if its weight, renormalized over the
+    # datasets not yet given their 1, times the remaining thread budget rounds
+    # below 1; since that condition is monotonic in the weight, the fixed point
+    # of repeatedly renormalizing is just a prefix of the ascending sort, found
+    # in one pass with a cumulative sum
+    positive = np.flatnonzero(weights > 0)
+    order = positive[np.argsort(weights[positive], kind="stable")]
+    sorted_weights = weights[order]
+    remaining_mass = 1 - np.concatenate([[0.0], np.cumsum(sorted_weights[:-1])])
+    remaining_n = n - np.arange(len(order))
+    takes_single = sorted_weights * remaining_n < remaining_mass
+    cutoff = len(order) if takes_single.all() else int(np.argmin(takes_single))
+    allocation[order[:cutoff]] = 1
+    n -= cutoff
+    # distribute the remaining threads over the remaining elements
+    weights[order[:cutoff]] = 0
+    if weights.sum() > 0:
         weights = weights / weights.sum()
-    # allocate the remaining elements
     fractional, integral = np.modf(weights * n)
     allocation += integral.astype(int)
     n -= integral.sum()